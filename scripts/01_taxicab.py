@@ -1,19 +1,306 @@
 import argparse
+import bisect
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 def manhattan_distance(point_a, point_b):
     return abs(point_a[0] - point_b[0]) + abs(point_a[1] - point_b[1])
 
 
+def evaluate_routes(routes, orientation=0):
+    """
+    Compute the final position and distance from the origin of many routes
+    of (direction, steps) moves at once, all starting at (0, 0) facing the
+    given orientation.
+
+    All moves are flattened into arrays. Turns become headings with a
+    cumulative sum per route taken mod 4, and the final positions are the
+    differences of the cumulative sum of the direction vectors at route
+    boundaries, so the whole batch is evaluated with a few array passes.
+    """
+    if np is None:
+        raise ImportError("evaluate_routes needs numpy")
+
+    lengths = np.array([len(route) for route in routes], dtype=np.int64)
+    turns = []
+    steps = []
+    for route in routes:
+        for direction, step_count in route:
+            if direction.lower() == 'r':
+                turns.append(1)
+            elif direction.lower() == 'l':
+                turns.append(-1)
+            else:
+                msg = "Unknown direction: {}".format(direction)
+                raise ValueError(msg)
+            steps.append(step_count)
+
+    turns = np.array(turns, dtype=np.int64)
+    steps = np.array(steps, dtype=np.int64)
+
+    starts = np.zeros(len(routes), dtype=np.int64)
+    starts[1:] = np.cumsum(lengths)[:-1]
+    ends = starts + lengths
+
+    turn_sums = np.concatenate([[0], np.cumsum(turns)])
+    headings = (orientation + turn_sums[1:] -
+                np.repeat(turn_sums[starts], lengths)) % 4
+
+    vectors = np.array([[0, 1], [1, 0], [0, -1], [-1, 0]], dtype=np.int64)
+    displacements = vectors[headings] * steps[:, np.newaxis]
+    displacement_sums = np.concatenate([np.zeros((1, 2), dtype=np.int64),
+                                        np.cumsum(displacements, axis=0)])
+
+    positions = displacement_sums[ends] - displacement_sums[starts]
+    distances = np.abs(positions).sum(axis=1)
+
+    return positions, distances
+
+
+def segment_positions(start, end):
+    step_x = cmp(end[0], start[0])
+    step_y = cmp(end[1], start[1])
+    steps = manhattan_distance(start, end)
+    for i in range(1, steps + 1):
+        yield (start[0] + step_x * i, start[1] + step_y * i)
+
+
+def parse_move(move):
+    move = move.strip()
+    return move[0], int(move[1:])
+
+
+def read_moves(fi, block_size=65536):
+    """
+    Lazily tokenize a comma separated moves file into (direction, steps)
+    pairs, reading it in fixed size blocks so that memory does not depend on
+    the size of the file.
+    """
+    pending = ''
+    while True:
+        block = fi.read(block_size)
+        if not block:
+            break
+
+        tokens = (pending + block.replace('\n', ',')).split(',')
+        pending = tokens.pop()
+        for token in tokens:
+            if token.strip():
+                yield parse_move(token)
+
+    if pending.strip():
+        yield parse_move(pending)
+
+
+def write_positions(positions, fo, batch_size=4096):
+    batch = []
+    for position in positions:
+        batch.append('{} {}\n'.format(position[0], position[1]))
+        if len(batch) == batch_size:
+            fo.write(''.join(batch))
+            batch = []
+    fo.write(''.join(batch))
+
+
+def consume(events):
+    for event in events:
+        pass
+
+
+class RouteIndex:
+    """
+    Index of the axis-aligned segments walked by a taxicab.
+
+    Horizontal segments are bucketed by their y coordinate and vertical ones
+    by their x coordinate, each bucket holding closed intervals along the
+    other axis. A sorted list of bucket keys per axis lets a new segment find
+    the perpendicular segments it may cross with a range query, so the cost
+    of registering a move depends on the number of moves walked so far and
+    not on the number of blocks they cover.
+    """
+
+    HORIZONTAL = 0
+    VERTICAL = 1
+
+    def __init__(self, x, y):
+        self.segments = []
+        self._lines = {self.HORIZONTAL: {}, self.VERTICAL: {}}
+        self._keys = {self.HORIZONTAL: [], self.VERTICAL: []}
+        self._insert(self.HORIZONTAL, y, x, x)
+        self.start = (x, y)
+
+    def _insert(self, axis, key, low, high):
+        lines = self._lines[axis]
+        if key not in lines:
+            lines[key] = []
+            bisect.insort(self._keys[axis], key)
+        lines[key].append((low, high))
+
+    def _hits(self, axis, key, low, high):
+        hits = []
+        for interval_low, interval_high in self._lines[axis].get(key, []):
+            if interval_low <= high and interval_high >= low:
+                hits.append((max(low, interval_low), min(high, interval_high)))
+
+        other_axis = 1 - axis
+        other_keys = self._keys[other_axis]
+        first = bisect.bisect_left(other_keys, low)
+        last = bisect.bisect_right(other_keys, high)
+        for other_key in other_keys[first:last]:
+            for interval_low, interval_high in self._lines[other_axis][other_key]:
+                if interval_low <= key <= interval_high:
+                    hits.append((other_key, other_key))
+                    break
+
+        return hits
+
+    def _split(self, start, end):
+        if start[1] == end[1]:
+            return self.HORIZONTAL, start[1], start[0], end[0]
+        elif start[0] == end[0]:
+            return self.VERTICAL, start[0], start[1], end[1]
+        else:
+            msg = "Segment is not axis-aligned: {} {}".format(str(start),
+                                                              str(end))
+            raise ValueError(msg)
+
+    def _point(self, axis, key, value):
+        if axis == self.HORIZONTAL:
+            return (value, key)
+        return (key, value)
+
+    def add_segment(self, start, end):
+        """
+        Register the segment walked from start to end and return the pieces
+        of it that go over already visited locations, in walking order, as
+        (first_point, last_point) pairs. The start point is not considered,
+        as it is the end of the previous segment.
+        """
+        if start == end:
+            return []
+
+        axis, key, origin, target = self._split(start, end)
+        step = 1 if target > origin else -1
+        low, high = sorted([origin + step, target])
+
+        merged = []
+        for hit_low, hit_high in sorted(self._hits(axis, key, low, high)):
+            if merged and hit_low <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], hit_high))
+            else:
+                merged.append((hit_low, hit_high))
+        if step < 0:
+            merged.reverse()
+
+        self._insert(axis, key, low, high)
+        self.segments.append((start, end))
+
+        pieces = []
+        for hit_low, hit_high in merged:
+            if step < 0:
+                hit_low, hit_high = hit_high, hit_low
+            pieces.append((self._point(axis, key, hit_low),
+                           self._point(axis, key, hit_high)))
+
+        return pieces
+
+    def crossings(self):
+        """
+        Return every piece of the route that goes over an already visited
+        location, in walking order. Single crossing points are returned as
+        pieces with the same first and last point.
+        """
+        replay = RouteIndex(self.start[0], self.start[1])
+        result = []
+        for start, end in self.segments:
+            result.extend(replay.add_segment(start, end))
+
+        return result
+
+    def _merged(self, axis, key):
+        merged = []
+        for low, high in sorted(self._lines[axis].get(key, [])):
+            if merged and low <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+            else:
+                merged.append((low, high))
+
+        return merged
+
+    def _covers(self, merged, value):
+        position = bisect.bisect_right(merged, (value, float('inf'))) - 1
+        return position >= 0 and merged[position][1] >= value
+
+    def visits(self, point):
+        """
+        Return how many times the route stepped on point. Every stored
+        interval excludes the start of its segment, so this is the number of
+        intervals covering it.
+        """
+        x, y = point
+        count = 0
+        for low, high in self._lines[self.HORIZONTAL].get(y, []):
+            if low <= x <= high:
+                count += 1
+        for low, high in self._lines[self.VERTICAL].get(x, []):
+            if low <= y <= high:
+                count += 1
+
+        return count
+
+    def __contains__(self, point):
+        x, y = point
+        for low, high in self._lines[self.HORIZONTAL].get(y, []):
+            if low <= x <= high:
+                return True
+        for low, high in self._lines[self.VERTICAL].get(x, []):
+            if low <= y <= high:
+                return True
+
+        return False
+
+    def __len__(self):
+        """
+        Number of distinct visited locations, counted from the merged
+        intervals of every row and column without expanding them to blocks.
+        """
+        rows = dict((y, self._merged(self.HORIZONTAL, y))
+                    for y in self._keys[self.HORIZONTAL])
+        row_keys = self._keys[self.HORIZONTAL]
+
+        total = 0
+        for merged in rows.values():
+            total += sum(high - low + 1 for low, high in merged)
+
+        for x in self._keys[self.VERTICAL]:
+            for low, high in self._merged(self.VERTICAL, x):
+                total += high - low + 1
+
+                first = bisect.bisect_left(row_keys, low)
+                last = bisect.bisect_right(row_keys, high)
+                for y in row_keys[first:last]:
+                    if self._covers(rows[y], x):
+                        total -= 1
+
+        return total
+
+
 class Taxicab:
     def __init__(self, x, y, orientation):
         self.x = x
         self.y = y
         self.orientation = orientation
         self.directions = ['N', 'E', 'S', 'W']
-        self.visited = set((x, y))
+        self.vectors = {'N': (0, 1), 'E': (1, 0), 'S': (0, -1), 'W': (-1, 0)}
+        self.visited = RouteIndex(x, y)
 
         self.first_repeated = None
+        self.moves = 0
 
     def turn(self, direction):
         if direction.lower() == 'r':
@@ -27,27 +314,44 @@ class Taxicab:
         self.orientation = self.orientation % 4
 
     def move_step_forward(self):
-        direction = self.directions[self.orientation]
-        if direction == 'N':
-            self.y += 1
-        elif direction == 'S':
-            self.y -= 1
-        elif direction == 'W':
-            self.x -= 1
-        elif direction == 'E':
-            self.x += 1
-
-        print self.x, self.y
-
-        if (self.x, self.y) in self.visited:
-            if not self.first_repeated:
-                self.first_repeated = (self.x, self.y)
-        else:
-            self.visited |= {(self.x, self.y)}
+        self.move_forward(1)
 
     def move_forward(self, steps):
-        for i in range(steps):
-            self.move_step_forward()
+        vector = self.vectors[self.directions[self.orientation]]
+        start = (self.x, self.y)
+        self.x += vector[0] * steps
+        self.y += vector[1] * steps
+
+        repeated = self.visited.add_segment(start, (self.x, self.y))
+        if repeated and self.first_repeated is None:
+            self.first_repeated = repeated[0][0]
+
+    def crossings(self):
+        return self.visited.crossings()
+
+    def visits(self, x, y):
+        return self.visited.visits((x, y))
+
+    def walk_segments(self, moves):
+        """
+        Lazily apply (direction, steps) moves, yielding the (start, end)
+        segment walked by each of them.
+        """
+        for direction, steps in moves:
+            start = (self.x, self.y)
+            self.turn(direction)
+            self.move_forward(steps)
+            self.moves += 1
+            yield start, (self.x, self.y)
+
+    def walk_positions(self, moves):
+        """
+        Lazily apply (direction, steps) moves, yielding every block visited
+        on the way.
+        """
+        for start, end in self.walk_segments(moves):
+            for position in segment_positions(start, end):
+                yield position
 
     def distance(self, other_x, other_y):
         return manhattan_distance((self.x, self.y), (other_x, other_y))
@@ -59,22 +363,23 @@ if __name__ == "__main__":
         description='Solve Advent of Code 2016 problem 01: Taxicab')
 
     parser.add_argument('in_file', help='Input moves file')
+    parser.add_argument('--trace', help='Write every visited block to file')
 
     args = parser.parse_args()
 
     fi = open(args.in_file)
-
-    moves_line = fi.readline().rstrip()
-    moves_list = moves_line.split(',')
-    moves_list = [m.rstrip().lstrip() for m in moves_list]
+    moves = read_moves(fi)
     my_taxicab = Taxicab(0, 0, 0)
 
-    for move in moves_list:
-        direction = move[0]
-        steps = int(move[1:])
-
-        my_taxicab.turn(direction)
-        my_taxicab.move_forward(steps)
+    start = time.time()
+    if args.trace:
+        fo = open(args.trace, 'w')
+        write_positions(my_taxicab.walk_positions(moves), fo)
+        fo.close()
+    else:
+        consume(my_taxicab.walk_segments(moves))
+    end = time.time()
+    fi.close()
 
     print "You are {} blocks away from where you started. ".format(
         my_taxicab.distance(0, 0))
@@ -83,3 +388,7 @@ if __name__ == "__main__":
         manhattan_distance((0, 0),
                             (my_taxicab.first_repeated[0], my_taxicab.first_repeated[1])),
         str(my_taxicab.first_repeated))
+
+    print "Processed {} moves in {} seconds ({} moves/sec)".format(
+        my_taxicab.moves, str(end-start),
+        int(my_taxicab.moves / max(end-start, 1e-9)))
@@ -1,4 +1,15 @@
 import argparse
+import collections
+import hashlib
+import multiprocessing
+import re
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 """
 --- Day 2: Bathroom Security ---
 
@@ -47,9 +58,51 @@ So, in this example, the bathroom code is 1985.
 """
 
 
+MOVE_RUNS = re.compile(r'U+|D+|L+|R+')
+
+
+class LineCache:
+    """
+    Bounded least recently used cache from (keypad, start key, line digest)
+    to the key the line ends on. It can be shared by several SecurityCode
+    objects.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries[key] = value
+
+        return value
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {'size': len(self.entries),
+                'max_size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
 class SecurityCode:
 
-    def __init__(self, code_board, finger_position):
+    def __init__(self, code_board, finger_position, line_cache=None):
         self.code_board = code_board
         self.code_board_shape = [len(code_board), len(code_board[0])]
         self.finger_position = finger_position
@@ -64,6 +117,57 @@ class SecurityCode:
                                                 str(finger_position))
             raise ValueError(msg)
 
+        self.keypad = [key for row in code_board for key in row]
+        self.transitions = self._compile_transitions()
+        self.offsets = {'U': -self.code_board_shape[1],
+                        'D': self.code_board_shape[1],
+                        'L': -1,
+                        'R': 1}
+        self.wall_distances = self._compile_wall_distances()
+        self.line_cache = line_cache
+        self.keypad_id = hashlib.sha1(repr(code_board)).digest()
+
+    def _compile_transitions(self):
+        """
+        Build, for every direction, a table from the flat index of a key to
+        the flat index of the key move_finger leads to from there.
+        """
+        saved_position = self.finger_position
+        transitions = {}
+        for direction in 'UDLR':
+            table = range(len(self.keypad))
+            for key in self.keys():
+                self.finger_position = list(key)
+                self.move_finger(direction)
+                table[self._index(key)] = self._index(self.finger_position)
+            transitions[direction] = table
+
+        self.finger_position = saved_position
+        return transitions
+
+    def _compile_wall_distances(self):
+        """
+        Build, for every direction, a table from the flat index of a key to
+        how many moves in that direction are possible before reaching a
+        blank key or the edge of the board.
+        """
+        wall_distances = {}
+        for direction in 'UDLR':
+            table = self.transitions[direction]
+            distances = [0] * len(self.keypad)
+            cells = range(len(self.keypad))
+            if self.offsets[direction] > 0:
+                cells.reverse()
+            for cell in cells:
+                if table[cell] != cell:
+                    distances[cell] = distances[table[cell]] + 1
+            wall_distances[direction] = distances
+
+        return wall_distances
+
+    def _index(self, position):
+        return position[0] * self.code_board_shape[1] + position[1]
+
     def _validate_input_dimensions(self, board_dims, position):
         ok = True
         ok = self._validate_closed_interval([0, board_dims[0]-1], position[0])
@@ -108,7 +212,7 @@ class SecurityCode:
     def press_key(self):
         return self.code_board[self.finger_position[0]][self.finger_position[1]]
 
-    def enter_code(self, moves_lines):
+    def enter_code_stepwise(self, moves_lines):
         result_code = ''
         for line in moves_lines:
             for direction in line:
@@ -117,30 +221,229 @@ class SecurityCode:
             result_code += self.press_key()
         return result_code
 
+    def _follow_line(self, position, line):
+        transitions = self.transitions
+        for direction in line:
+            table = transitions.get(direction)
+            if table is not None:
+                position = table[position]
+
+        return position
+
+    def _follow_runs(self, position, line):
+        wall_distances = self.wall_distances
+        offsets = self.offsets
+        for run in MOVE_RUNS.finditer(line):
+            direction = run.group()[0]
+            steps = min(run.end() - run.start(),
+                        wall_distances[direction][position])
+            position += offsets[direction] * steps
+
+        return position
+
+    def enter_code_runs(self, moves_lines):
+        """
+        Same as enter_code, but collapsing every run of identical moves into
+        a single jump clamped by the distance to the nearest wall, so the
+        cost depends on the number of runs rather than of moves.
+        """
+        position = self._index(self.finger_position)
+        pressed_keys = []
+        for line in moves_lines:
+            position = self._follow_runs(position, line)
+            pressed_keys.append(self.keypad[position])
+
+        self.finger_position = list(divmod(position, self.code_board_shape[1]))
+        return ''.join(pressed_keys)
+
+    def _follow_line_cached(self, position, line):
+        key = (self.keypad_id, position, hashlib.sha1(line).digest())
+        end_position = self.line_cache.get(key)
+        if end_position is None:
+            end_position = self._follow_line(position, line)
+            self.line_cache.put(key, end_position)
+
+        return end_position
+
+    def press_keys(self, moves_lines):
+        """
+        Lazily follow lines of moves taken from any iterable (a list, a file,
+        stdin or a socket file) and yield each pressed key as soon as its
+        line ends.
+        """
+        follow_line = self._follow_line
+        if self.line_cache is not None:
+            follow_line = self._follow_line_cached
+
+        columns = self.code_board_shape[1]
+        position = self._index(self.finger_position)
+        for line in moves_lines:
+            position = follow_line(position, line)
+            self.finger_position = list(divmod(position, columns))
+            yield self.keypad[position]
+
+    def enter_line(self, line):
+        for key in self.press_keys([line]):
+            return key
+
+    def enter_code(self, moves_lines):
+        return ''.join(self.press_keys(moves_lines))
+
+    def keys(self):
+        return [(i, j)
+                for i in range(self.code_board_shape[0])
+                for j in range(self.code_board_shape[1])
+                if self._is_valid([i, j])]
+
+    def line_map(self, line):
+        """
+        Compile a line of moves into a map from the key the finger starts on
+        to the key it ends on.
+        """
+        result = {}
+        for key in self.keys():
+            position = self._follow_line(self._index(key), line)
+            result[key] = divmod(position, self.code_board_shape[1])
+
+        return result
+
+    def enter_code_parallel(self, moves_lines, processes=None):
+        """
+        Same as enter_code, but the lines are compiled in chunks by a pool of
+        worker processes. Each chunk is solved for every possible start key,
+        so chaining the chunk results only takes one lookup per chunk.
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        chunk_count = max(1, min(len(moves_lines), processes * 4))
+        chunk_size = max(1, -(-len(moves_lines) // chunk_count))
+        jobs = [(self.code_board, moves_lines[i:i+chunk_size])
+                for i in range(0, len(moves_lines), chunk_size)]
+
+        pool = multiprocessing.Pool(processes)
+        chunk_results = pool.map(_solve_chunk, jobs)
+        pool.close()
+        pool.join()
+
+        result_code = ''
+        position = tuple(self.finger_position)
+        for chunk_result in chunk_results:
+            pressed_keys, position = chunk_result[position]
+            result_code += pressed_keys
+
+        self.finger_position = list(position)
+        return result_code
+
+
+class MultiSecurityCode:
+    """
+    Follow the same instructions on several keypads in a single pass.
+
+    The keys of all keypads are laid out in one flat index space, with one
+    transition array per direction concatenating the transition tables of
+    every SecurityCode. The finger positions are kept in a single array, so
+    each move is one array lookup regardless of the number of keypads.
+    """
+
+    def __init__(self, security_codes):
+        if np is None:
+            raise ImportError("MultiSecurityCode needs numpy")
+
+        self.security_codes = security_codes
+        self.offsets = []
+        offset = 0
+        for security_code in security_codes:
+            self.offsets.append(offset)
+            offset += len(security_code.keypad)
+
+        self.keypad = np.array([key for security_code in security_codes
+                                for key in security_code.keypad], dtype=object)
+        self.transitions = {}
+        for direction in 'UDLR':
+            self.transitions[direction] = np.concatenate(
+                [np.array(security_code.transitions[direction]) + offset
+                 for security_code, offset in zip(security_codes,
+                                                  self.offsets)])
+
+    def enter_code(self, moves_lines):
+        transitions = self.transitions
+        positions = np.array(
+            [security_code._index(security_code.finger_position) + offset
+             for security_code, offset in zip(self.security_codes,
+                                              self.offsets)])
+        pressed_positions = []
+        for line in moves_lines:
+            for direction in line:
+                table = transitions.get(direction)
+                if table is not None:
+                    positions = table[positions]
+            pressed_positions.append(positions)
+
+        pressed_positions = np.array(pressed_positions, dtype=int).reshape(
+            len(pressed_positions), len(self.security_codes))
+        pressed_keys = self.keypad[pressed_positions]
+
+        result_codes = []
+        for i, security_code in enumerate(self.security_codes):
+            result_codes.append(''.join(pressed_keys[:, i]))
+            position = positions[i] - self.offsets[i]
+            security_code.finger_position = list(
+                divmod(position, security_code.code_board_shape[1]))
+
+        return result_codes
+
+
+def _solve_chunk(job):
+    code_board, moves_lines = job
+    security_code = SecurityCode(code_board, [0, 0])
+    line_maps = [security_code.line_map(line) for line in moves_lines]
+
+    result = {}
+    for key in security_code.keys():
+        pressed_keys = ''
+        position = key
+        for line_map in line_maps:
+            position = line_map[position]
+            pressed_keys += code_board[position[0]][position[1]]
+        result[key] = (pressed_keys, position)
+
+    return result
+
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
         description='Solve Advent of Code 2016 problem 02: Bathroom security')
 
-    parser.add_argument('in_file', help='Input moves file')
+    parser.add_argument('in_file', help='Input moves file, - for stdin')
+    parser.add_argument('--stream', action='store_true',
+                        help='Press keys as soon as each line is read')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Decode with a pool of this many processes')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Compare stepwise and transition table decoding')
+    parser.add_argument('--single-pass', action='store_true',
+                        help='Decode both keypads in a single pass')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='Cache the end key of up to this many lines')
 
     args = parser.parse_args()
+
+    if args.cache_size and (args.single_pass or args.processes):
+        parser.error('--cache-size does not apply to --single-pass or '
+                     '--processes')
+
+    line_cache = None
+    if args.cache_size:
+        line_cache = LineCache(args.cache_size)
     code_board = [['1', '2', '3'],
                   ['4', '5', '6'],
                   ['7', '8', '9']]
 
     finger_position = [1, 1]
 
-    my_security_code = SecurityCode(code_board, finger_position)
-
-    fi = open(args.in_file)
-    moves_lines = fi.readlines()
-    fi.close()
-
-    result_code = my_security_code.enter_code(moves_lines)
-
-    print "Result code first floor: {}".format(result_code)
+    my_security_code = SecurityCode(code_board, finger_position, line_cache)
 
     code_board_second_floor = [[' ', ' ', '1', ' ', ' '],
                                [' ', '2', '3', '4', ' '],
@@ -151,9 +454,56 @@ if __name__ == "__main__":
     finger_position_second_floor = [2, 0]
 
     my_security_code_second_floor = SecurityCode(code_board_second_floor,
-                                                 finger_position_second_floor)
+                                                 finger_position_second_floor,
+                                                 line_cache)
+
+    if args.in_file == '-':
+        fi = sys.stdin
+    else:
+        fi = open(args.in_file)
+
+    if args.stream:
+        for line in iter(fi.readline, ''):
+            start = time.time()
+            key = my_security_code.enter_line(line)
+            key_second_floor = my_security_code_second_floor.enter_line(line)
+            end = time.time()
+            print "Pressed {} on first floor, {} on second floor ({} ms)".format(
+                key, key_second_floor, (end-start) * 1000)
+            sys.stdout.flush()
+
+        sys.exit(0)
+
+    moves_lines = fi.readlines()
+    fi.close()
 
-    result_code_second_floor = my_security_code_second_floor.enter_code(moves_lines)
+    if args.single_pass:
+        multi_security_code = MultiSecurityCode([my_security_code,
+                                                 my_security_code_second_floor])
+        result_code, result_code_second_floor = multi_security_code.enter_code(
+            moves_lines)
+    elif args.processes:
+        result_code = my_security_code.enter_code_parallel(moves_lines,
+                                                           args.processes)
+        result_code_second_floor = my_security_code_second_floor.enter_code_parallel(
+            moves_lines, args.processes)
+    else:
+        result_code = my_security_code.enter_code(moves_lines)
+        result_code_second_floor = my_security_code_second_floor.enter_code(moves_lines)
 
+    print "Result code first floor: {}".format(result_code)
     print "Result code second floor: {}".format(result_code_second_floor)
 
+    if line_cache is not None:
+        print "Line cache: {}".format(str(line_cache.stats()))
+
+    if args.benchmark:
+        moves_count = sum(len(line) for line in moves_lines)
+        for method in ['enter_code_stepwise', 'enter_code', 'enter_code_runs']:
+            benchmark_code = SecurityCode(code_board_second_floor,
+                                          finger_position_second_floor[:])
+            start = time.time()
+            getattr(benchmark_code, method)(moves_lines)
+            end = time.time()
+            print "{}: {} moves/sec".format(
+                method, int(moves_count / max(end-start, 1e-9)))
@@ -1,4 +1,12 @@
 import argparse
+import multiprocessing
+import os
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 """
 --- Day 3: Squares With Three Sides ---
 
@@ -44,6 +52,41 @@ class TriangleValidator:
 
         return good_triangle_count
 
+    def count_good_triangles_array(self, sides):
+        """
+        Count the good triangles in an array whose last axis holds the three
+        sides, sorting the sides so that a single comparison is enough.
+        """
+        sorted_sides = np.sort(sides, axis=-1)
+        good = sorted_sides[..., 0] + sorted_sides[..., 1] > sorted_sides[..., 2]
+        return int(np.count_nonzero(good))
+
+    def count_good_triangles_stream(self, rows):
+        """
+        Count the good triangles listed horizontally and vertically in a
+        single pass over rows of sides, keeping only the current group of
+        three rows for the vertical ones.
+        """
+        good_horizontal = 0
+        good_vertical = 0
+        group = []
+        for row in rows:
+            if self.validate_side_list(row):
+                good_horizontal += 1
+
+            group.append(row)
+            if len(group) == 3:
+                for column in zip(*group):
+                    if self.validate_side_list(column):
+                        good_vertical += 1
+                group = []
+
+        if group:
+            msg = "Number of rows is not a multiple of three."
+            raise ValueError(msg)
+
+        return good_horizontal, good_vertical
+
 
 def parse_input_horizontal(fi):
     lines = fi.readlines()
@@ -74,28 +117,184 @@ def parse_input_vertical(fi):
         
     return triangle_list
 
+def parse_input_stream(fi, block_size=65536):
+    """
+    Lazily read rows of sides from a file in fixed size blocks.
+    """
+    pending = ''
+    while True:
+        block = fi.read(block_size)
+        if not block:
+            break
+
+        lines = (pending + block).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield [int(v) for v in line.split()]
+
+    if pending.strip():
+        yield [int(v) for v in pending.split()]
+
+
+class FileRange:
+    """
+    File-like reader limited to the [start, end) byte range of a file.
+    """
+
+    def __init__(self, fi, start, end):
+        fi.seek(start)
+        self.fi = fi
+        self.remaining = end - start
+
+    def read(self, size):
+        block = self.fi.read(min(size, self.remaining))
+        self.remaining -= len(block)
+        return block
+
+
+def _count_newlines(job):
+    path, start, end = job
+    fi = open(path, 'rb')
+    file_range = FileRange(fi, start, end)
+    count = 0
+    block = file_range.read(65536)
+    while block:
+        count += block.count('\n')
+        block = file_range.read(65536)
+    fi.close()
+
+    return count
+
+
+def _count_shard(job):
+    path, start, end = job
+    fi = open(path, 'rb')
+    validator = TriangleValidator()
+    result = validator.count_good_triangles_stream(
+        parse_input_stream(FileRange(fi, start, end)))
+    fi.close()
+
+    return result
+
+
+def shard_boundaries(path, shards, pool):
+    """
+    Split a file into byte ranges that start on a line whose index is a
+    multiple of three, so no vertical group of triangles is cut. The lines
+    before each raw split point are counted by the pool first.
+    """
+    size = os.path.getsize(path)
+    raw_splits = [size * i // shards for i in range(shards + 1)]
+    newlines = pool.map(_count_newlines,
+                        [(path, raw_splits[i], raw_splits[i+1])
+                         for i in range(shards)])
+
+    boundaries = [0]
+    fi = open(path, 'rb')
+    for i in range(1, shards):
+        line_index = sum(newlines[:i])
+        fi.seek(max(raw_splits[i] - 1, 0))
+        if raw_splits[i] > 0 and fi.read(1) != '\n':
+            fi.readline()
+            line_index += 1
+        while line_index % 3:
+            fi.readline()
+            line_index += 1
+        boundaries.append(max(boundaries[-1], min(fi.tell(), size)))
+    fi.close()
+    boundaries.append(size)
+
+    return boundaries
+
+
+def count_good_triangles_sharded(path, processes):
+    """
+    Count the good triangles listed horizontally and vertically using a pool
+    of processes, each running count_good_triangles_stream on one shard.
+    """
+    pool = multiprocessing.Pool(processes)
+    boundaries = shard_boundaries(path, processes, pool)
+    partial_counts = pool.map(_count_shard,
+                              [(path, boundaries[i], boundaries[i+1])
+                               for i in range(processes)])
+    pool.close()
+    pool.join()
+
+    return (sum(count[0] for count in partial_counts),
+            sum(count[1] for count in partial_counts))
+
+
+def parse_input_array(fi):
+    if np is None:
+        raise ImportError("parse_input_array needs numpy")
+
+    return np.fromstring(fi.read(), dtype=np.int64, sep=' ').reshape(-1, 3)
+
+
+def vertical_view(sides):
+    """
+    View the triangles listed vertically in groups of three rows, without
+    copying the sides.
+    """
+    return sides.reshape(-1, 3, 3).transpose(0, 2, 1)
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
         description='Solve Advent of Code 2016 problem 03: Squares with three sides')
 
     parser.add_argument('in_file', help='Input triangles file')
+    parser.add_argument('--vectorized', action='store_true',
+                        help='Read the file once into an array')
+    parser.add_argument('--stream', action='store_true',
+                        help='Count in a single pass with constant memory')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Count shards of the file with this many processes')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Report sharded speedup for 1 to --processes workers')
 
     args = parser.parse_args()
 
     validator = TriangleValidator()
 
-    fi = open(args.in_file)
-    triangle_list_horizontal = parse_input_horizontal(fi)
-    fi.close()
+    if args.vectorized:
+        fi = open(args.in_file)
+        sides = parse_input_array(fi)
+        fi.close()
 
-    fi = open(args.in_file)
-    triangle_list_vertical = parse_input_vertical(fi)
-    fi.close()
+        good_triangles_horizontal = validator.count_good_triangles_array(sides)
+        good_triangles_vertical = validator.count_good_triangles_array(
+            vertical_view(sides))
+    elif args.processes:
+        good_triangles_horizontal, good_triangles_vertical = (
+            count_good_triangles_sharded(args.in_file, args.processes))
+    elif args.stream:
+        fi = open(args.in_file)
+        good_triangles_horizontal, good_triangles_vertical = (
+            validator.count_good_triangles_stream(parse_input_stream(fi)))
+        fi.close()
+    else:
+        fi = open(args.in_file)
+        triangle_list_horizontal = parse_input_horizontal(fi)
+        fi.close()
+
+        fi = open(args.in_file)
+        triangle_list_vertical = parse_input_vertical(fi)
+        fi.close()
 
-    good_triangles_horizontal = validator.count_good_triangles(triangle_list_horizontal)
-    good_triangles_vertical = validator.count_good_triangles(triangle_list_vertical)
+        good_triangles_horizontal = validator.count_good_triangles(triangle_list_horizontal)
+        good_triangles_vertical = validator.count_good_triangles(triangle_list_vertical)
 
     print "In the list, there are {} good triangles".format(good_triangles_horizontal)
     print "In the list (vertically), there are {} good triangles".format(good_triangles_vertical)
 
+    if args.benchmark:
+        elapsed = {}
+        for processes in range(1, max(args.processes, 1) + 1):
+            start = time.time()
+            count_good_triangles_sharded(args.in_file, processes)
+            elapsed[processes] = time.time() - start
+            print "{} workers: {} seconds, speedup {}".format(
+                processes, elapsed[processes], elapsed[1] / elapsed[processes])
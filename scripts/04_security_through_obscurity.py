@@ -1,4 +1,11 @@
 import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import string
+import sys
 """
 --- Day 4: Security Through Obscurity ---
 
@@ -27,22 +34,17 @@ What is the sum of the sector IDs of the real rooms?
 
 """
 
-def compare(a, b):
-    result = 0
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
 
-    if a[1] > b[1]:
-        result = -1
-    elif a[1] < b[1]:
-        result = 1
-    else:
-        if a[0] < b[0]:
-            result = -1
-        elif a[0] > b[0]:
-            result = 1
-        else:
-            result = 0
+SHIFT_TABLES = [string.maketrans(ALPHABET + '-',
+                                 ALPHABET[n:] + ALPHABET[:n] + ' ')
+                for n in range(len(ALPHABET))]
 
-    return result
+Room = collections.namedtuple('Room', ['name', 'sector_id', 'checksum'])
+
+UNSHIFT_TABLES = [string.maketrans(ALPHABET + ' ',
+                                   ALPHABET[-n:] + ALPHABET[:-n] + '-')
+                  for n in range(len(ALPHABET))]
 
 
 def extract_checksum(code):
@@ -57,51 +59,56 @@ def extract_letters(code):
     return code[0:code.rfind('-')]
 
 
-def count_letters(string):
-    result = {}
-    string = [s for s in string if s != '-']
-    for s in string:
-        result[s] = result.get(s, 0) + 1
+def parse_room(code):
+    separator = code.rfind('-')
+    return Room(code[0:separator], int(code[separator+1:-7]), code[-6:-1])
 
-    return result
 
+def count_letters_array(string):
+    return [string.count(letter) for letter in ALPHABET]
 
-def validate_code(letters, checksum):
-    counts = count_letters(letters)
-    sorted_items = sorted(counts.items(), cmp=compare, reverse=False)
-    result = True
-    for i in range(len(checksum)):
-        if checksum[i] != sorted_items[i][0]:
-            result = False
 
-    return result
+def validate_code(letters, checksum):
+    """
+    Check the checksum against a 26 slot letter count without sorting.
+    Checksum letters must be present and come in strictly decreasing
+    (count, reverse alphabetical) rank, which rejects a room as soon as one
+    of them is out of place. The last one must then outrank every letter
+    left out of the checksum, so the checksum is exactly the top letters.
+    """
+    counts = count_letters_array(letters)
+    last_rank = None
+    for letter in checksum:
+        index = ALPHABET.find(letter)
+        if index < 0 or counts[index] == 0:
+            return False
+
+        rank = (counts[index], -index)
+        if last_rank is not None and rank >= last_rank:
+            return False
+        last_rank = rank
+
+    if last_rank is None:
+        return True
+
+    for index in range(len(ALPHABET)):
+        if (counts[index], -index) > last_rank:
+            if ALPHABET[index] not in checksum:
+                return False
+
+    return True
 
 
 def extract_sector_value(code):
     result = 0
-    letters = extract_letters(code)
-    checksum = extract_checksum(code)
-    if validate_code(letters, checksum):
-        result += extract_sector_id(code)
+    room = parse_room(code)
+    if validate_code(room.name, room.checksum):
+        result += room.sector_id
 
     return result
 
 def shift_name(letters, number):
-    result = ''
-    for l in letters:
-        if l == '-':
-            result += ' '
-        else:
-            result += shift_letter(l, number)
-
-    return result
-
-
-def shift_letter(letter, number):
-    alphabet = 'abcdefghijklmnopqrstuvwxyz'
-    letter_position = alphabet.find(letter)
-    new_position = (letter_position + number) % len(alphabet)
-    return alphabet[new_position]
+    return letters.translate(SHIFT_TABLES[number % len(ALPHABET)])
 
 
 def extract_shifted_name(code):
@@ -112,6 +119,130 @@ def extract_shifted_name(code):
     return new_name
 
 
+def format_room(room):
+    return '{} {}\n'.format(shift_name(room.name, room.sector_id),
+                            room.sector_id)
+
+
+def decrypt_rooms(code_list, fo, batch_size=4096):
+    """
+    Write the decrypted name and sector ID of every room to fo, in batches.
+    Codes may be lines read from a file; blank ones are skipped.
+    """
+    batch = []
+    for line in code_list:
+        code = line.rstrip()
+        if not code:
+            continue
+
+        batch.append(format_room(parse_room(code)))
+        if len(batch) == batch_size:
+            fo.write(''.join(batch))
+            batch = []
+    fo.write(''.join(batch))
+
+
+def _process_chunk(lines):
+    sector_id_sum = 0
+    decrypted = []
+    for line in lines:
+        code = line.rstrip()
+        if not code:
+            continue
+
+        room = parse_room(code)
+        if validate_code(room.name, room.checksum):
+            sector_id_sum += room.sector_id
+        decrypted.append(format_room(room))
+
+    return sector_id_sum, ''.join(decrypted)
+
+
+def _chunks(lines, chunk_size):
+    lines = iter(lines)
+    chunk = list(itertools.islice(lines, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(lines, chunk_size))
+
+
+def process_rooms(lines, fo, processes=0, chunk_size=4096):
+    """
+    Parse every room line once, writing its decrypted name and sector ID to
+    fo and returning the sector ID sum of the real rooms. With processes,
+    chunks of lines are handled by a pool, keeping the output in order.
+    """
+    chunks = _chunks(lines, chunk_size)
+    if processes:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_process_chunk, chunks)
+    else:
+        results = itertools.imap(_process_chunk, chunks)
+
+    sector_id_sum = 0
+    for chunk_sum, decrypted in results:
+        sector_id_sum += chunk_sum
+        fo.write(decrypted)
+
+    if processes:
+        pool.close()
+        pool.join()
+
+    return sector_id_sum
+
+
+class RoomIndex:
+    """
+    Index of rooms keyed by their encrypted name and their sector ID mod 26.
+
+    A plaintext name is looked up by encrypting it under each of the 26
+    possible shifts, so finding a room takes 26 hash lookups instead of
+    decrypting every room. The index records the path, size and mtime of
+    the rooms file it was built from, so a stale saved index can be told
+    apart and rebuilt, and the sector ID sum of its real rooms.
+    """
+
+    def __init__(self, source=None):
+        self.source = source
+        self.sector_id_sum = 0
+        self.rooms = {}
+
+    @staticmethod
+    def source_of(path):
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+
+    def add(self, room):
+        if validate_code(room.name, room.checksum):
+            self.sector_id_sum += room.sector_id
+        key = (room.name, room.sector_id % len(ALPHABET))
+        self.rooms.setdefault(key, []).append(room.sector_id)
+
+    def find(self, name):
+        result = []
+        for shift in range(len(ALPHABET)):
+            key = (name.translate(UNSHIFT_TABLES[shift]), shift)
+            result.extend(self.rooms.get(key, []))
+
+        return sorted(result)
+
+    def save(self, fo):
+        json.dump({'source': self.source,
+                   'sector_id_sum': self.sector_id_sum,
+                   'rooms': [[name, shift, sector_ids] for (name, shift),
+                             sector_ids in self.rooms.items()]}, fo)
+
+    @staticmethod
+    def load(fi):
+        data = json.load(fi)
+        room_index = RoomIndex(data['source'])
+        room_index.sector_id_sum = data['sector_id_sum']
+        for name, shift, sector_ids in data['rooms']:
+            room_index.rooms[(str(name), shift)] = sector_ids
+
+        return room_index
+
+
 def sum_sector_values(code_list):
     acum = 0
     for code in code_list:
@@ -126,22 +257,48 @@ if __name__ == "__main__":
         description='Solve Advent of Code 2016 problem 04: Security through obscurity')
 
     parser.add_argument('in_file', help='Input codes file')
+    parser.add_argument('--find', help='Print the sector IDs of this room name')
+    parser.add_argument('--index', help='Room index file, built if missing')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Process chunks of rooms with this many processes')
 
     args = parser.parse_args()
 
-    fi = open(args.in_file)
-    codes = [line.rstrip() for line in fi.readlines()]
-
-    fi.close()
-
-    sector_id_sum = sum_sector_values(codes)
-
-
-    print "The sector_ids for the true codes sum {}".format(sector_id_sum)
-
-    for code in codes:
-        shifted_name = extract_shifted_name(code)
-        print shifted_name, extract_sector_id(code)
-        # if shifted_name == 'north pole objects':
-        #    print extract_sector_id(code)
+    if args.find:
+        source = RoomIndex.source_of(args.in_file)
+        room_index = None
+        if args.index and os.path.exists(args.index):
+            fi = open(args.index)
+            try:
+                room_index = RoomIndex.load(fi)
+            except (ValueError, KeyError):
+                pass
+            fi.close()
+
+            if room_index is not None and room_index.source != source:
+                room_index = None
+
+        if room_index is None:
+            room_index = RoomIndex(source)
+            fi = open(args.in_file)
+            for line in fi:
+                code = line.rstrip()
+                if code:
+                    room_index.add(parse_room(code))
+            fi.close()
+
+            if args.index:
+                fo = open(args.index, 'w')
+                room_index.save(fo)
+                fo.close()
+
+        print "The sector_ids for the true codes sum {}".format(
+            room_index.sector_id_sum)
+        print "Room {} is in sectors {}".format(args.find,
+                                                room_index.find(args.find))
+    else:
+        fi = open(args.in_file)
+        sector_id_sum = process_rooms(fi, sys.stdout, args.processes)
+        fi.close()
 
+        print "The sector_ids for the true codes sum {}".format(sector_id_sum)
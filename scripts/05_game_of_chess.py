@@ -1,6 +1,18 @@
 import argparse
+import collections
 import time
 import hashlib
+import json
+import math
+import multiprocessing
+import os
+import struct
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 """
 --- Day 5: How About a Nice Game of Chess? ---
@@ -38,9 +50,12 @@ Input: ugkcyxxp
 """
 
 
-def hash_meets_condition(string):
+LEADING_ZEROS = 5
+
+
+def hash_meets_condition(string, leading_zeros=LEADING_ZEROS):
     encoded_string = string.encode("hex")
-    return encoded_string[0:5] == '00000'
+    return encoded_string[0:leading_zeros] == '0' * leading_zeros
 
 
 def compute_md5_hash_code(string):
@@ -50,68 +65,658 @@ def compute_md5_hash_code(string):
     return hashed_code
 
 
-def find_next_hash_number(door_id, attached_number):
-    current_code = '{}{}'.format(door_id, attached_number)
-    current_hash = compute_md5_hash_code(current_code)
-
-    while not hash_meets_condition(current_hash):
-        attached_number += 1
+def search_hash_numbers(door_id, start, stop, leading_zeros=LEADING_ZEROS):
+    """
+    Return the (number, digest) pairs meeting the condition for the numbers
+    in [start, stop). The door ID is hashed once and its MD5 state copied
+    for every number, and the condition is checked on the raw digest: whole
+    zero bytes, then a byte below 0x10 for an odd number of zeros.
+    """
+    zero_bytes = leading_zeros // 2
+    zero_prefix = '\x00' * zero_bytes
+    odd_zeros = leading_zeros % 2 == 1
+
+    prefix_hash = hashlib.md5(door_id)
+    hits = []
+    for attached_number in xrange(start, stop):
+        current_hash = prefix_hash.copy()
+        current_hash.update(str(attached_number))
+        digest = current_hash.digest()
+        if digest[0:zero_bytes] == zero_prefix:
+            if not odd_zeros or digest[zero_bytes] < '\x10':
+                hits.append((attached_number, digest))
+
+    return hits
+
+
+MD5_SHIFTS = [7, 12, 17, 22] * 4 + [5, 9, 14, 20] * 4 + \
+    [4, 11, 16, 23] * 4 + [6, 10, 15, 21] * 4
+
+MD5_CONSTANTS = [int(abs(math.sin(i + 1)) * 2**32) & 0xffffffff
+                 for i in range(64)]
+
+MD5_INITIAL_STATE = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476]
+
+
+def _md5_lanes(blocks):
+    """
+    Run the MD5 compression function over an array of single 64 byte
+    blocks, one lane per row, returning the (lanes, 16) digest bytes.
+    Message words equal in every lane are folded into the round constant.
+    """
+    words = np.ascontiguousarray(blocks.view('<u4').T)
+    constant_words = [None] * 16
+    for g in range(16):
+        if (words[g] == words[g, 0]).all():
+            constant_words[g] = int(words[g, 0])
+
+    state = [np.full(len(blocks), value, dtype=np.uint32)
+             for value in MD5_INITIAL_STATE]
+    a, b, c, d = [lane_state.copy() for lane_state in state]
+    f = np.empty_like(a)
+    rotated = np.empty_like(a)
+    for i in range(64):
+        if i < 16:
+            np.bitwise_xor(c, d, out=f)
+            f &= b
+            f ^= d
+            g = i
+        elif i < 32:
+            np.bitwise_xor(b, c, out=f)
+            f &= d
+            f ^= c
+            g = (5 * i + 1) % 16
+        elif i < 48:
+            np.bitwise_xor(b, c, out=f)
+            f ^= d
+            g = (3 * i + 5) % 16
+        else:
+            np.invert(d, out=f)
+            f |= b
+            f ^= c
+            g = (7 * i) % 16
+
+        f += a
+        if constant_words[g] is None:
+            f += words[g]
+            f += np.uint32(MD5_CONSTANTS[i])
+        else:
+            f += np.uint32((MD5_CONSTANTS[i] + constant_words[g]) & 0xffffffff)
+
+        shift = MD5_SHIFTS[i]
+        np.left_shift(f, np.uint32(shift), out=rotated)
+        f >>= np.uint32(32 - shift)
+        rotated |= f
+        a, d, c, b = d, c, b, a
+        np.add(c, rotated, out=b)
+
+    digest = np.stack([state[0] + a, state[1] + b, state[2] + c, state[3] + d],
+                      axis=1)
+    return digest.astype('<u4').view(np.uint8)
+
+
+def search_hash_numbers_numpy(door_id, start, stop,
+                              leading_zeros=LEADING_ZEROS):
+    """
+    Same as search_hash_numbers, but hashing every number in [start, stop)
+    at once with a vectorized MD5. Numbers are grouped by digit count so
+    each group is a fixed shape array of single block messages.
+    """
+    if np is None:
+        raise ImportError("search_hash_numbers_numpy needs numpy")
+
+    zero_bytes = leading_zeros // 2
+    hits = []
+    group_start = start
+    while group_start < stop:
+        digits = len(str(group_start))
+        group_stop = min(stop, 10 ** digits)
+        message_length = len(door_id) + digits
+        if message_length > 55:
+            msg = "Door ID and number do not fit in one MD5 block."
+            raise ValueError(msg)
+
+        numbers = np.arange(group_start, group_stop, dtype=np.uint64)
+        blocks = np.zeros((len(numbers), 64), dtype=np.uint8)
+        blocks[:, :len(door_id)] = np.frombuffer(door_id, dtype=np.uint8)
+        for k in range(digits):
+            power = np.uint64(10 ** (digits - 1 - k))
+            blocks[:, len(door_id) + k] = numbers // power % np.uint64(10) + 48
+        blocks[:, message_length] = 0x80
+        blocks[:, 56:64] = np.frombuffer(struct.pack('<Q', message_length * 8),
+                                         dtype=np.uint8)
+
+        digests = _md5_lanes(blocks)
+        good = np.all(digests[:, :zero_bytes] == 0, axis=1)
+        if leading_zeros % 2 == 1:
+            good &= digests[:, zero_bytes] < 0x10
+
+        for lane in np.flatnonzero(good):
+            hits.append((int(numbers[lane]), digests[lane].tostring()))
+
+        group_start = group_stop
+
+    return hits
+
+
+SEARCH_ENGINES = {'hashlib': search_hash_numbers,
+                  'numpy': search_hash_numbers_numpy}
+
+
+def benchmark_hash_rate(door_id, count):
+    start = time.time()
+    for attached_number in xrange(count):
         current_code = '{}{}'.format(door_id, attached_number)
-        current_hash = compute_md5_hash_code(current_code)
-
-    return attached_number
+        hash_meets_condition(compute_md5_hash_code(current_code))
+    end = time.time()
+    print "Formatted hashing: {} hashes/sec".format(int(count / (end-start)))
 
+    start = time.time()
+    search_hash_numbers(door_id, 0, count)
+    end = time.time()
+    print "Prefix state hashing: {} hashes/sec".format(int(count / (end-start)))
+
+    if np is not None:
+        start = time.time()
+        search_hash_numbers_numpy(door_id, 0, count)
+        end = time.time()
+        print "Vectorized hashing: {} hashes/sec".format(int(count / (end-start)))
+
+
+class HashHitStore:
+    """
+    Append-only file of the (number, digest) hits found for a door ID, as
+    fixed size binary records. After every searched block a checkpoint
+    record with an all 0xff digest, which can never meet the condition,
+    stores the number the search has reached so it can be resumed.
+    """
+
+    RECORD = struct.Struct('<Q16s')
+    CHECKPOINT = '\xff' * 16
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = []
+        self.scanned = 0
+
+        if os.path.exists(path):
+            fi = open(path, 'rb')
+            data = fi.read()
+            fi.close()
+
+            complete_size = len(data) - len(data) % self.RECORD.size
+            for offset in range(0, complete_size, self.RECORD.size):
+                number, digest = self.RECORD.unpack_from(data, offset)
+                if digest == self.CHECKPOINT:
+                    self.scanned = max(self.scanned, number)
+                else:
+                    self.hits.append((number, digest))
+
+            self.hits = sorted(set(hit for hit in self.hits
+                                   if hit[0] < self.scanned))
+            if complete_size != len(data):
+                fo = open(path, 'r+b')
+                fo.truncate(complete_size)
+                fo.close()
+
+        self.fo = open(path, 'ab')
+
+    @staticmethod
+    def path_for(cache_dir, door_id, leading_zeros=LEADING_ZEROS):
+        file_name = '{}_{}.hits'.format(door_id.encode('hex'), leading_zeros)
+        return os.path.join(cache_dir, file_name)
+
+    def append(self, hits, scanned):
+        records = [self.RECORD.pack(number, digest) for number, digest in hits]
+        records.append(self.RECORD.pack(scanned, self.CHECKPOINT))
+        self.fo.write(''.join(records))
+        self.fo.flush()
+        self.scanned = scanned
+
+    def close(self):
+        self.fo.close()
+
+
+class SearchMonitor:
+    """
+    Report the progress of a hash search: hashes per second, hits found,
+    current number and, once a target number of hits is set, the estimated
+    time left given the chance of a hash meeting the condition. Searches
+    update it once per block and it reports at most once per interval,
+    either as a text line or as a JSON line.
+    """
+
+    def __init__(self, fo=sys.stderr, interval=1.0, json_lines=False,
+                 leading_zeros=LEADING_ZEROS):
+        self.fo = fo
+        self.interval = interval
+        self.json_lines = json_lines
+        self.hit_probability = 16.0 ** -leading_zeros
+        self.target_hits = None
+        self.hits = 0
+        self.attached_number = 0
+        self.start_number = 0
+        self.start = time.time()
+        self.last_report = self.start
+
+    def resume(self, attached_number, hits):
+        self.attached_number = attached_number
+        self.start_number = attached_number
+        self.hits = hits
+
+    def update(self, attached_number, new_hits):
+        self.attached_number = attached_number
+        self.hits += new_hits
+        now = time.time()
+        if now - self.last_report >= self.interval:
+            self.report(now)
+
+    def metrics(self, now):
+        elapsed = now - self.start
+        hash_rate = 0.0
+        if elapsed > 0:
+            hash_rate = (self.attached_number - self.start_number) / elapsed
+
+        eta = None
+        if self.target_hits is not None and hash_rate > 0:
+            remaining_hits = max(self.target_hits - self.hits, 0)
+            eta = remaining_hits / self.hit_probability / hash_rate
+
+        return {'elapsed': elapsed,
+                'hashes_per_sec': hash_rate,
+                'hits': self.hits,
+                'index': self.attached_number,
+                'eta': eta}
+
+    def report(self, now):
+        self.last_report = now
+        metrics = self.metrics(now)
+        if self.json_lines:
+            self.fo.write(json.dumps(metrics) + '\n')
+        else:
+            eta = 'unknown'
+            if metrics['eta'] is not None:
+                eta = '{:.0f} seconds'.format(metrics['eta'])
+            self.fo.write("{hashes_per_sec:.0f} hashes/sec, {hits} hits, "
+                          "index {index}, eta {eta}\n".format(
+                              **dict(metrics, eta=eta)))
+        self.fo.flush()
+
+
+def sequential_hash_hits(door_id, attached_number=0, store=None,
+                         block_size=100000, leading_zeros=LEADING_ZEROS,
+                         engine='hashlib', monitor=None):
+    search = SEARCH_ENGINES[engine]
+    while True:
+        hits = search(door_id, attached_number, attached_number + block_size,
+                      leading_zeros)
+        attached_number += block_size
+        if store is not None:
+            store.append(hits, attached_number)
+        if monitor is not None:
+            monitor.update(attached_number, len(hits))
+
+        for hit in hits:
+            yield hit
+
+
+def _search_block(job):
+    door_id, start, block_size, leading_zeros, engine = job
+    return SEARCH_ENGINES[engine](door_id, start, start + block_size,
+                                  leading_zeros)
+
+
+def parallel_hash_hits(door_id, attached_number=0, processes=None,
+                       store=None, block_size=50000,
+                       leading_zeros=LEADING_ZEROS, engine='hashlib',
+                       monitor=None):
+    """
+    Yield the (number, digest) pairs of the hashes meeting the condition,
+    searching fixed size blocks of numbers on a pool of processes. A bounded
+    queue of blocks is kept in flight and their hits are released strictly
+    in block order, so the stream is the same as sequential_hash_hits.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    pool = multiprocessing.Pool(processes)
+    pending = collections.deque()
+    closed_early = False
+    try:
+        while True:
+            while len(pending) < 2 * processes:
+                job = (door_id, attached_number, block_size, leading_zeros,
+                       engine)
+                pending.append((attached_number + block_size,
+                                pool.apply_async(_search_block, (job,))))
+                attached_number += block_size
+
+            block_end, block_result = pending.popleft()
+            hits = block_result.get()
+            if store is not None:
+                store.append(hits, block_end)
+            if monitor is not None:
+                monitor.update(block_end, len(hits))
+
+            for hit in hits:
+                yield hit
+    except GeneratorExit:
+        closed_early = True
+        raise
+    finally:
+        if closed_early:
+            pool.terminate()
+        else:
+            for block_end, block_result in pending:
+                block_result.wait()
+            pool.close()
+        pool.join()
+
+
+def hash_hits(door_id, processes=0, attached_number=0, store=None,
+              leading_zeros=LEADING_ZEROS, engine='hashlib', monitor=None):
+    if processes:
+        return parallel_hash_hits(door_id, attached_number, processes, store,
+                                  leading_zeros=leading_zeros, engine=engine,
+                                  monitor=monitor)
+
+    return sequential_hash_hits(door_id, attached_number, store,
+                                leading_zeros=leading_zeros, engine=engine,
+                                monitor=monitor)
+
+
+class HashHits:
+    """
+    Lazily extended, memoized list of the (number, digest) pairs meeting the
+    condition for a door ID. Both password modes read from the same one, so
+    the hits found while computing one are reused by the other.
+    """
+
+    def __init__(self, door_id, processes=0, store=None,
+                 leading_zeros=LEADING_ZEROS, engine='hashlib', monitor=None):
+        self.door_id = door_id
+        self.leading_zeros = leading_zeros
+        self.hits = []
+        self.store = store
+        self.monitor = monitor
+        attached_number = 0
+        if store is not None:
+            self.hits = list(store.hits)
+            attached_number = store.scanned
+        if monitor is not None:
+            monitor.resume(attached_number, len(self.hits))
+
+        self.source = hash_hits(door_id, processes, attached_number, store,
+                                leading_zeros, engine, monitor)
+
+    def __getitem__(self, index):
+        while len(self.hits) <= index:
+            self.hits.append(next(self.source))
+
+        return self.hits[index]
+
+    def __iter__(self):
+        index = 0
+        while True:
+            yield self[index]
+            index += 1
+
+    def close(self):
+        self.source.close()
+        if self.store is not None:
+            self.store.close()
+
+
+class HashHitsCache:
+    """
+    The HashHits of each (door ID, leading zeros) pair, so both password
+    modes share one search. Whoever creates the cache closes it, which stops
+    the searches and their pools. Asking again for a door ID with different
+    search options is an error rather than silently reusing the first ones.
+    """
+
+    def __init__(self):
+        self.hits = {}
+
+    def get(self, door_id, processes=0, cache_dir=None,
+            leading_zeros=LEADING_ZEROS, engine='hashlib', monitor=None):
+        key = (door_id, leading_zeros)
+        options = (processes, cache_dir, engine, monitor)
+        if key not in self.hits:
+            store = None
+            if cache_dir is not None:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                store = HashHitStore(HashHitStore.path_for(cache_dir, door_id,
+                                                           leading_zeros))
+            self.hits[key] = (options, HashHits(door_id, processes, store,
+                                                leading_zeros, engine,
+                                                monitor))
+
+        cached_options, hits = self.hits[key]
+        if cached_options != options:
+            msg = "Hits for {} are already being searched with other options.".format(
+                door_id)
+            raise ValueError(msg)
+
+        return hits
+
+    def close(self):
+        for options, hits in self.hits.values():
+            hits.close()
+        self.hits.clear()
+
+
+def find_hash_password(door_id, pass_length, processes=0, cache_dir=None,
+                       leading_zeros=LEADING_ZEROS, engine='hashlib',
+                       monitor=None, hit_cache=None):
+    if hit_cache is None:
+        hit_cache = HashHitsCache()
+        try:
+            return find_hash_password(door_id, pass_length, processes,
+                                      cache_dir, leading_zeros, engine,
+                                      monitor, hit_cache)
+        finally:
+            hit_cache.close()
+
+    hits = hit_cache.get(door_id, processes, cache_dir, leading_zeros, engine,
+                         monitor)
+    if hits.monitor is not None:
+        hits.monitor.target_hits = pass_length
 
-def find_hash_password(door_id, pass_length):
-    attached_number = 0
     password = ''
     for i in range(pass_length):
-        attached_number = find_next_hash_number(door_id, attached_number)
-        valid_code = '{}{}'.format(door_id, attached_number)
-        valid_hash = compute_md5_hash_code(valid_code).encode("hex")
-        password += valid_hash[5]
-        attached_number += 1
+        attached_number, valid_hash = hits[i]
+        password += valid_hash.encode("hex")[leading_zeros]
 
     return password
 
-def find_hash_password_part_two(door_id, pass_length):
-    attached_number = 0
+def find_hash_password_part_two(door_id, pass_length, processes=0,
+                                cache_dir=None, leading_zeros=LEADING_ZEROS,
+                                engine='hashlib', monitor=None,
+                                hit_cache=None):
+    if hit_cache is None:
+        hit_cache = HashHitsCache()
+        try:
+            return find_hash_password_part_two(door_id, pass_length,
+                                               processes, cache_dir,
+                                               leading_zeros, engine, monitor,
+                                               hit_cache)
+        finally:
+            hit_cache.close()
+
+    shared_hits = hit_cache.get(door_id, processes, cache_dir, leading_zeros,
+                                engine, monitor)
+    if shared_hits.monitor is not None:
+        # Filling pass_length positions out of 16 takes 16 * H(pass_length)
+        # hits on average, as in the coupon collector's problem.
+        shared_hits.monitor.target_hits = 16 * sum(1.0 / i for i in
+                                                   range(1, pass_length + 1))
+
+    hits = iter(shared_hits)
     password = ['_']*pass_length
 
     while '_' in password:
-        attached_number = find_next_hash_number(door_id, attached_number)
-        valid_code = '{}{}'.format(door_id, attached_number)
-        valid_hash = compute_md5_hash_code(valid_code).encode("hex")
-        position = int('0x{}'.format(valid_hash[5]), 16)
+        attached_number, valid_hash = next(hits)
+        valid_hash = valid_hash.encode("hex")
+        position = int('0x{}'.format(valid_hash[leading_zeros]), 16)
         if position < pass_length and password[position] == '_':
-            password[position] = valid_hash[6]
+            password[position] = valid_hash[leading_zeros + 1]
             print ''.join(password)
 
-        attached_number += 1
-
     return ''.join(password)
 
 
+class DoorJob:
+
+    def __init__(self, door_id, leading_zeros, pass_length):
+        self.door_id = door_id
+        self.leading_zeros = leading_zeros
+        self.pass_length = pass_length
+        self.password = ''
+        self.attached_number = 0
+        self.hashes = 0
+        self.elapsed = 0.0
+
+    def done(self):
+        return len(self.password) == self.pass_length
+
+    def summary(self):
+        return {'door_id': self.door_id,
+                'leading_zeros': self.leading_zeros,
+                'password': self.password,
+                'hashes': self.hashes,
+                'elapsed': self.elapsed}
+
+
+def crack_door_ids(jobs, processes=None, block_size=50000, engine='hashlib'):
+    """
+    Find the passwords of many (door ID, leading zeros, password length)
+    jobs on a shared pool of processes. Blocks of numbers are handed out to
+    the unfinished jobs in turn, so short jobs finish without waiting for
+    long ones, and each job's blocks are read back in order. Returns a
+    summary per job with its password, hashes tried and elapsed time.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    door_jobs = [DoorJob(*job) for job in jobs]
+    start = time.time()
+    pool = multiprocessing.Pool(processes)
+    in_flight = collections.deque()
+    turn = 0
+    try:
+        while not all(door_job.done() for door_job in door_jobs):
+            active_jobs = [door_job for door_job in door_jobs
+                           if not door_job.done()]
+            while len(in_flight) < 2 * processes:
+                door_job = active_jobs[turn % len(active_jobs)]
+                turn += 1
+                block = (door_job.door_id, door_job.attached_number,
+                         block_size, door_job.leading_zeros, engine)
+                in_flight.append((door_job,
+                                  pool.apply_async(_search_block, (block,))))
+                door_job.attached_number += block_size
+
+            door_job, block_result = in_flight.popleft()
+            hits = block_result.get()
+            if door_job.done():
+                continue
+
+            door_job.hashes += block_size
+            for attached_number, valid_hash in hits:
+                door_job.password += valid_hash.encode("hex")[door_job.leading_zeros]
+                if door_job.done():
+                    door_job.elapsed = time.time() - start
+                    break
+    finally:
+        for door_job, block_result in in_flight:
+            block_result.wait()
+        pool.close()
+        pool.join()
+
+    return [door_job.summary() for door_job in door_jobs]
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
         description='Solve Advent of Code 2016 problem 05: Game of chess')
 
-    parser.add_argument('code', help='Input code')
+    parser.add_argument('code', nargs='?', help='Input code')
+    parser.add_argument('--jobs',
+                        help='File of "door_id leading_zeros length" jobs')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Search with a pool of this many processes')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Compare hashing speed before searching')
+    parser.add_argument('--cache-dir',
+                        help='Keep found hashes here to resume later searches')
+    parser.add_argument('--engine', choices=sorted(SEARCH_ENGINES),
+                        default='hashlib', help='MD5 search engine')
+    parser.add_argument('--progress-interval', type=float,
+                        help='Report search progress every this many seconds '
+                        '(1 by default with --progress-file)')
+    parser.add_argument('--progress-file',
+                        help='Write progress as JSON lines here, not stderr')
 
     args = parser.parse_args()
 
+    if args.jobs:
+        fi = open(args.jobs)
+        jobs = []
+        for line in fi.readlines():
+            if line.strip():
+                door_id, leading_zeros, pass_length = line.split()
+                jobs.append((door_id, int(leading_zeros), int(pass_length)))
+        fi.close()
+
+        for summary in crack_door_ids(jobs, args.processes or None,
+                                      engine=args.engine):
+            print "{door_id} ({leading_zeros} zeros): {password}, " \
+                "{hashes} hashes in {elapsed} seconds".format(**summary)
+
+        parser.exit()
+
+    if args.code is None:
+        parser.error('a door ID code or --jobs is needed')
+
+    if args.benchmark:
+        benchmark_hash_rate(args.code, 1000000)
+
+    if args.progress_file and args.progress_interval is None:
+        args.progress_interval = 1.0
+
+    monitor = None
+    if args.progress_interval:
+        if args.progress_file:
+            monitor = SearchMonitor(open(args.progress_file, 'a'),
+                                    args.progress_interval, json_lines=True)
+        else:
+            monitor = SearchMonitor(sys.stderr, args.progress_interval)
+
+    hit_cache = HashHitsCache()
 
     start = time.time()
-    password = find_hash_password(args.code, 8)
+    password = find_hash_password(args.code, 8, args.processes,
+                                  args.cache_dir, engine=args.engine,
+                                  monitor=monitor, hit_cache=hit_cache)
     end = time.time()
 
     print "The password is {}".format(password)
     print "It took {} seconds to hack".format(str(end-start))
 
     start = time.time()
-    password_two = find_hash_password_part_two(args.code, 8)
+    password_two = find_hash_password_part_two(args.code, 8, args.processes,
+                                               args.cache_dir,
+                                               engine=args.engine,
+                                               monitor=monitor,
+                                               hit_cache=hit_cache)
     end = time.time()
 
     print "The new password is {}".format(password_two)
     print "It took {} seconds to hack".format(str(end-start))
+
+    hit_cache.close()
+    if args.progress_file and monitor is not None:
+        monitor.fo.close()
@@ -0,0 +1,56 @@
+"""
+Cross-check the vectorized numpy MD5 engine against hashlib.
+
+Run with: python -m unittest discover tests
+"""
+import imp
+import os
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      os.pardir, 'scripts', '05_game_of_chess.py')
+game_of_chess = imp.load_source('game_of_chess', SCRIPT)
+
+
+@unittest.skipIf(game_of_chess.np is None, "numpy is not installed")
+class SearchEngineTest(unittest.TestCase):
+
+    def assert_engines_agree(self, door_id, start, stop, leading_zeros):
+        expected = game_of_chess.search_hash_numbers(door_id, start, stop,
+                                                     leading_zeros)
+        actual = game_of_chess.search_hash_numbers_numpy(door_id, start, stop,
+                                                         leading_zeros)
+        self.assertEqual(actual, expected)
+        return expected
+
+    def test_every_digest(self):
+        hits = self.assert_engines_agree('abc', 0, 2000, 0)
+        self.assertEqual(len(hits), 2000)
+
+    def test_digit_count_boundary(self):
+        for leading_zeros in range(4):
+            self.assert_engines_agree('abc', 99990, 100010, leading_zeros)
+        self.assert_engines_agree('ugkcyxxp', 99990, 100010, 0)
+
+    def test_odd_and_even_leading_zeros(self):
+        for leading_zeros in range(1, 5):
+            hits = self.assert_engines_agree('abc', 0, 50000, leading_zeros)
+            self.assertTrue(hits)
+
+    def test_known_hit(self):
+        hits = self.assert_engines_agree('abc', 3231900, 3232000, 5)
+        self.assertEqual([number for number, digest in hits], [3231929])
+
+    def test_long_door_id(self):
+        door_id = 'x' * 40
+        self.assert_engines_agree(door_id, 0, 1000, 0)
+        self.assert_engines_agree(door_id, 99990, 100010, 1)
+        self.assert_engines_agree(door_id, 999000, 1001000, 2)
+
+    def test_door_id_too_long(self):
+        with self.assertRaises(ValueError):
+            game_of_chess.search_hash_numbers_numpy('x' * 55, 0, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()